@@ -6,23 +6,61 @@ This file contains miscellaneous helper functions.
 import os
 import re
 import sys
+import stat
+import time
+import subprocess
+import threading
+import grp
+import pwd
 import logging
-from distutils.util import strtobool
-from functools import lru_cache
-from typing import Any, Callable, TypeVar, Tuple, cast, List
+import logging.handlers
+from functools import lru_cache, wraps
+from typing import Any, Callable, Dict, TypeVar, Tuple, Optional, cast, List
 
-try:
-    from sh import getent, ErrorReturnCode
-except ModuleNotFoundError:
-    print("python3 sh-module is missing. Please install it with:\n\n"
-          "yum install python36-sh")
-    sys.exit(1)
+DIR_NAME_REGEX = re.compile(r'^(/[\w-]+)+\Z')
+
+# Size of the stat and group lookup caches. A single run rarely touches
+# more than a few thousand directories, groups or users.
+CACHE_SIZE = int(os.environ.get('CLUSTERSTOR_CACHE_SIZE', '4096'))
+
+# Seconds after which group and user lookups are resolved again.
+CACHE_TTL = float(os.environ.get('CLUSTERSTOR_CACHE_TTL', '300'))
+
+# If this environment variable is set (to anything else than 0),
+# confirmations are skipped and their default answers are used.
+ASSUME_YES_ENV = 'CLUSTERSTOR_ASSUME_YES'
+
+# Separator used by print_header
+HEADER_SEPARATOR = 60*'-'
+
+# Accepted answers for confirmations
+TRUE_STRINGS = frozenset(('y', 'yes', 't', 'true', 'on', '1'))
+FALSE_STRINGS = frozenset(('n', 'no', 'f', 'false', 'off', '0'))
+
+# Lock that keeps multi-line warnings together when directories are
+# processed in parallel
+WARNING_LOCK = threading.RLock()
+
+# Cached stat results by directory (see stat_dir). A dictionary is used
+# instead of lru_cache, so that entries of a single directory can be cleared
+# without affecting directories processed by other threads.
+STAT_CACHE = {}  # type: Dict[str, Optional[os.stat_result]]
+STAT_CACHE_LOCK = threading.Lock()
+
+# Type for decorated functions
+F = TypeVar('F', bound=Callable[..., Any])
+
+# Default logger. Loggers are singletons, so this is the same logger
+# that create_logger configures.
+logger = logging.getLogger('clusterstor')
 
 
 def create_logger(verbose: bool) -> None:
-    """ This function sets the default logger. """
+    """ This function sets the default logger.
 
-    logger = logging.getLogger('clusterstor')
+    Messages are buffered and written in batches. Warnings and errors
+    flush the buffer immediately and so do all user prompts.
+    """
 
     handler = logging.StreamHandler(sys.stdout)
 
@@ -30,49 +68,89 @@ def create_logger(verbose: bool) -> None:
 
     formatter = logging.Formatter('%(message)s')
     handler.setFormatter(formatter)
-    logger.addHandler(handler)
+
+    buffered_handler = logging.handlers.MemoryHandler(
+        capacity=512, flushLevel=logging.WARNING, target=handler)
+    logger.addHandler(buffered_handler)
 
 def get_logger():
     """ This function gives the default logger. """
 
-    return logging.getLogger('clusterstor')
+    return logger
+
+def flush_logger() -> None:
+    """ This function writes out all buffered log messages. """
+
+    for handler in logger.handlers:
+        handler.flush()
+
+def str_to_bool(value: str) -> bool:
+    """ This function converts a yes/no-answer into a boolean.
+    Raises ValueError for unknown answers. """
+
+    value = value.strip().lower()
+    if value in TRUE_STRINGS:
+        return True
+    if value in FALSE_STRINGS:
+        return False
+    raise ValueError("Invalid truth value: '{0}'".format(value))
+
+def assume_yes() -> bool:
+    """ This function tells whether all confirmations should be skipped. """
+
+    return os.environ.get(ASSUME_YES_ENV, '') not in ('', '0')
+
+def set_assume_yes(value: bool) -> None:
+    """ This function sets whether all confirmations should be skipped. """
+
+    if value:
+        os.environ[ASSUME_YES_ENV] = '1'
+    else:
+        os.environ.pop(ASSUME_YES_ENV, None)
 
 def confirm(verification_str: str, default: bool = False) -> bool:
-    """ This function asks for a verification to a query. """
+    """ This function asks for a verification to a query. If confirmations
+    are skipped, the default answer is used, so that safety stops with
+    default=False are never answered with yes. """
+
+    if assume_yes():
+        return default
 
     response = default
     response_str = "[Y/n]" if default else "[y/N]"
+    flush_logger()
     try:
         verification = input("{0} {1}\n".format(verification_str, response_str))
-        response = bool(strtobool(verification))
+        response = str_to_bool(verification)
     except ValueError:
         response = response
 
     return response
 
 def pause_until_input() -> None:
-    """ This function asks for confirmation until execution resumes. """
+    """ This function asks for confirmation until execution resumes.
+    Nothing is asked if confirmations are skipped. """
+    if assume_yes():
+        return
+    flush_logger()
     input("Press RETURN to continue.")
 
 def ask_for_continue() -> None:
     """ This function asks whether execution should continue. """
     if not confirm("Continue with execution?"):
+        if assume_yes():
+            logger.error("Stopping execution, as this cannot be confirmed "
+                         "automatically.")
         sys.exit(1)
 
 def print_header(header: str) -> None:
     """ This helper function prints a very visible header. """
 
-    logger = get_logger()
-
-    separator = 60*'-'
-
-    logger.info('\n%s\n%s\n%s', separator, header.upper(), separator)
+    logger.info('\n%s\n%s\n%s', HEADER_SEPARATOR, header.upper(), HEADER_SEPARATOR)
 
 def print_smallheader(header: str) -> None:
     """ This helper function prints a smaller header. """
 
-    logger = get_logger()
-
     separator = len(header)*'-'
 
     logger.debug('\n%s\n%s\n', header, separator)
@@ -80,17 +158,59 @@ def print_smallheader(header: str) -> None:
 def print_warning(warning: str) -> None:
     """ This helper function prints a very visible warning. """
 
-    logger = get_logger()
     warning = "WARNING: {0}".format(warning)
     separator = len(warning)*'#'
     logger.warning('\n%s\n%s\n%s\n', separator, warning, separator)
 
 
-@lru_cache(maxsize=65536)
+def lfs(*args) -> str:
+    """ This helper function runs an lfs command and returns its output.
+    Raises subprocess.CalledProcessError if the command fails. """
+
+    cmd = ['lfs'] + [str(arg) for arg in args]
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    if result.returncode != 0:
+        logger.debug("Command '%s' failed: %s", ' '.join(cmd), result.stderr.strip())
+        raise subprocess.CalledProcessError(
+            result.returncode, cmd, output=result.stdout, stderr=result.stderr)
+
+    return result.stdout
+
+
+def timed_lru_cache(maxsize: int, ttl: float) -> Callable[[F], F]:
+    """ This decorator works like lru_cache, but the whole cache is
+    cleared once ttl seconds have passed since it was last cleared. """
+
+    def decorator(func: F) -> F:
+
+        cached_func = lru_cache(maxsize=maxsize)(func)
+        expires = [time.monotonic() + ttl]
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            now = time.monotonic()
+            if now >= expires[0]:
+                cached_func.cache_clear()
+                expires[0] = now + ttl
+            return cached_func(*args, **kwargs)
+
+        wrapper.cache_clear = cached_func.cache_clear
+        wrapper.cache_info = cached_func.cache_info
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
 def stat_dir(dirname: str):
-    """ This helper function stats a directory. """
+    """ This helper function stats a directory. Outputs are cached until
+    clear_stat_cache is called for the directory. """
 
-    logger = get_logger()
+    try:
+        return STAT_CACHE[dirname]
+    except KeyError:
+        pass
 
     stat_response = None
 
@@ -98,67 +218,107 @@ def stat_dir(dirname: str):
 
         stat_response = os.stat(dirname)
 
-    except FileNotFoundError as error:
-        logger.warning("Could not stat directory '%s': %s", dirname, error)
+    except (FileNotFoundError, NotADirectoryError) as error:
+        logger.debug("Could not stat directory '%s': %s", dirname, error)
+
+    with STAT_CACHE_LOCK:
+        if len(STAT_CACHE) >= CACHE_SIZE:
+            STAT_CACHE.clear()
+        STAT_CACHE[dirname] = stat_response
 
     return stat_response
 
 
-def get_dir_permissions(dirname: str) -> str:
-    """ This helper function checks the permissions of a directory. """
-    
+def get_dir_stat_triple(dirname: str) -> Tuple[int, int, int]:
+    """ This helper function returns the permission bits, GID and UID of a
+    directory from a single stat. Outputs are cached. """
+
     stat_response = stat_dir(dirname)
 
     if stat_response is not None:
-        return oct(stat_response.st_mode)[-4:]
-    
+        return (stat.S_IMODE(stat_response.st_mode),
+                stat_response.st_gid,
+                stat_response.st_uid)
+
+    return (None, None, None)
+
+
+def clear_stat_cache(dirname: str = None) -> None:
+    """ This helper function clears cached stat results of a directory, or
+    all cached stat results if dirname is not given. It should be called
+    after a directory has been created or modified. """
+
+    with STAT_CACHE_LOCK:
+        if dirname is None:
+            STAT_CACHE.clear()
+        else:
+            STAT_CACHE.pop(dirname, None)
+
+
+def get_dir_permissions(dirname: str) -> str:
+    """ This helper function checks the permissions of a directory. """
+
+    mode = get_dir_stat_triple(dirname)[0]
+
+    if mode is not None:
+        return '{0:04o}'.format(mode)
+
     return None
 
 
-def get_dir_gid(dirname: str) -> int: 
+def get_dir_gid(dirname: str) -> int:
     """ This helper function checks for a GID of a directory. """
-    
-    stat_response = stat_dir(dirname)
 
-    if stat_response is not None:
-        return stat_response.st_gid
-    
-    return None
+    return get_dir_stat_triple(dirname)[1]
 
 
-def get_dir_uid(dirname: str) -> int: 
+def get_dir_uid(dirname: str) -> int:
     """ This helper function checks for a UID of a directory. """
-    
-    stat_response = stat_dir(dirname)
 
-    if stat_response is not None:
-        return stat_response.st_uid
-    
-    return None
+    return get_dir_stat_triple(dirname)[2]
 
 
 def check_dir_name(dirname: str) -> bool:
     """ This helper function checks that dirname has only allowed
     characters (a-zA-Z0-9_-). """
 
-    match = re.match(r"^(/[\w-]+)+$", dirname)
+    match = DIR_NAME_REGEX.match(dirname)
 
     return match is not None
 
 
-def check_dir_exists(dirname: str, dryrun: bool = True) -> bool:
-    """ This helper function checks whether a directory already exists. """
+def validate_dir_name(dirname: str, dryrun: bool = True) -> bool:
+    """ This helper function checks that dirname has only allowed
+    characters. Raises an error if it does not, unless dryrun is set. """
 
-    logger = get_logger()
+    valid_name = check_dir_name(dirname)
 
     try:
-        assert check_dir_name(dirname), \
+        assert valid_name, \
                "Directory name '{0} has invalid characters!".format(dirname)
+    except AssertionError as error:
+        if dryrun:
+            logger.debug(("Got an error '%s' with directory '%s', but will "
+                          "continue due to dry-run."), error, dirname)
+        else:
+            raise error
+
+    return valid_name
 
-        assert os.path.isdir(os.path.dirname(dirname)), \
+
+def check_dir_exists(dirname: str, dryrun: bool = True) -> bool:
+    """ This helper function checks whether a directory already exists. """
+
+    validate_dir_name(dirname, dryrun=dryrun)
+
+    stat_response = stat_dir(dirname)
+
+    try:
+        base_stat_response = stat_dir(os.path.dirname(dirname))
+        assert base_stat_response is not None and stat.S_ISDIR(base_stat_response.st_mode), \
                'Base directory for folder {0} does not exist!'.format(dirname)
 
-        assert os.path.isdir(dirname) or not os.path.exists(dirname), \
+        assert stat_response is None or stat.S_ISDIR(stat_response.st_mode), \
                 "Path '{0}' exists, but it is not a directory!".format(dirname)
     except AssertionError as error:
         if dryrun:
@@ -167,43 +327,73 @@ def check_dir_exists(dirname: str, dryrun: bool = True) -> bool:
         else:
             raise error
 
-    return os.path.isdir(dirname)
+    return stat_response is not None and stat.S_ISDIR(stat_response.st_mode)
+
+
+@timed_lru_cache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+def lookup_group_id(group_name: str) -> Optional[int]:
+    """ This helper function returns group id for a group or, if no such
+    group exists, user id for a user with the same name. Returns None if
+    neither exists. Outputs, including missing names, are cached. """
 
+    try:
+        group_id = grp.getgrnam(group_name).gr_gid
+    except KeyError:
+        logger.debug(f'Group "{group_name}" was not found. Trying user "{group_name}" instead.')
+        try:
+            group_id = pwd.getpwnam(group_name).pw_uid
+        except KeyError:
+            group_id = None
+    return group_id
+
+@timed_lru_cache(maxsize=1, ttl=CACHE_TTL)
+def get_group_id_map() -> Dict[str, int]:
+    """ This helper function returns a dictionary from all group names to
+    group ids. The groups are read with a single grp.getgrall() call and
+    the result is cached. """
+
+    return {group.gr_name: group.gr_gid for group in grp.getgrall()}
+
+def preload_group_ids() -> None:
+    """ This function loads the ids of all groups at once, so that following
+    get_group_id calls are dictionary lookups instead of separate NSS
+    queries. Use it before looking up the ids of many groups. """
+
+    get_group_id_map()
 
-@lru_cache(maxsize=65536)
 def get_group_id(group_name: str) -> int:
     """ This helper function returns group id for a group. Outputs are cached. """
 
-    logger = get_logger()
+    group_id = None
+    # Only use the group id map if it has been preloaded
+    if get_group_id_map.cache_info().currsize:
+        group_id = get_group_id_map().get(group_name)
+    if group_id is None:
+        group_id = lookup_group_id(group_name)
+    if group_id is None:
+        raise ValueError(f'Could not find group or user "{group_name}"!')
+    return group_id
+
+@timed_lru_cache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
+def get_user_id(user_name: str) -> int:
+    """ This helper function returns user id for a user. Outputs are cached. """
 
     try:
-        getent_output = getent('group', group_name)
-    except ErrorReturnCode as error:
-        logger.debug(f'Command "getent group {group_name}" failed. Trying "getent passwd {group_name}" instead.')
-        try:
-            getent_output = getent('passwd', group_name)
-        except ErrorReturnCode as error:
-            raise ValueError(f'Command "getent group {group_name}" and "getent passwd {group_name}" returned errors! Error:\n {error}')
-    group_id = int(getent_output.split(':')[2])
-    return group_id
+        user_id = pwd.getpwnam(user_name).pw_uid
+    except KeyError as error:
+        raise ValueError(f'Could not find user "{user_name}"! Error:\n {error}')
+    return user_id
 
-@lru_cache(maxsize=65536)
+@timed_lru_cache(maxsize=CACHE_SIZE, ttl=CACHE_TTL)
 def get_group_users(group_name: str) -> List[str]:
     """ This helper function returns users that belong to a group. Outputs are cached. """
-    getent_output = getent('group', group_name) 
-    group_users = getent_output.split(':')[3].strip().split(',')
+    group_users = list(grp.getgrnam(group_name).gr_mem)
     return group_users
 
-# Type for decorated functions
-F = TypeVar('F', bound=Callable[..., Any])
-
 def catch_interrupt(func: F) -> F:
     """ This helper function catches keyboard interrupts for interactive functions. """
     
     def wrapper(*args, **kwargs):
-        
-        logger = get_logger()
-    
         try:
             return func(*args, **kwargs)
         except KeyboardInterrupt as interrupt:
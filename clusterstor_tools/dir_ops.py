@@ -3,33 +3,71 @@
 This file contains functions that create directories.
 """
 
-import sys
 import os
-
-try:
-    from sh import lfs, chmod, chown, chgrp
-except ModuleNotFoundError:
-    print("python3 sh-module is missing. Please install it with:\n\n"
-          "yum install python36-sh")
-    sys.exit(1)
-
+from typing import NamedTuple
 
 from clusterstor_tools.common import (
-    confirm, get_dir_gid, get_dir_uid, get_dir_permissions,
-    ask_for_continue, check_dir_exists, print_warning, get_logger
+    confirm, assume_yes, get_dir_stat_triple, clear_stat_cache,
+    get_group_id, get_user_id, ask_for_continue, check_dir_exists,
+    validate_dir_name, print_warning, lfs, logger
     )
 from clusterstor_tools.stripe_ops import get_dirstripe_count
 from clusterstor_tools.quota_ops import generate_project_id
 
+
+class DirContext(NamedTuple):
+    """ This class contains information about a directory that is
+    resolved once and shared between the set_dir_*-functions.
+
+    Project directories and work directories use the same ID for the
+    owner, the group and the project, so only one ID is resolved.
+    """
+    path: str
+    project_id: int
+    mode: int
+    gid: int
+    uid: int
+
+    @property
+    def exists(self) -> bool:
+        """ True if the directory could be stat'd. """
+        return self.uid is not None
+
+
+def get_dir_context(dirname: str, name: str = None, dryrun: bool = True) -> DirContext:
+    """ This function resolves the project ID for name and stats the
+    directory once. """
+
+    project_id = generate_project_id(name, dryrun=dryrun) if name is not None else None
+
+    return DirContext(dirname, project_id, *get_dir_stat_triple(dirname))
+
+
 def create_dir(dirname: str, dryrun: bool = True, skip_confirm: bool = False) -> bool:
     """ This function creates a simple directory such as a project directory
     or user's work directory.
     """
 
-    logger = get_logger()
-
     directory_created = False
-    if check_dir_exists(dirname, dryrun=dryrun):
+
+    if (skip_confirm or assume_yes()) and not dryrun:
+        # Nothing to ask, so try to create the directory right away
+        # instead of checking for it first.
+        validate_dir_name(dirname, dryrun=dryrun)
+        try:
+            os.mkdir(dirname)
+            directory_created = True
+        except FileExistsError:
+            check_dir_exists(dirname, dryrun=dryrun)
+        except FileNotFoundError:
+            check_dir_exists(dirname, dryrun=dryrun)
+            raise
+        if directory_created:
+            logger.info("Created directory '%s'", dirname)
+            clear_stat_cache(dirname)
+        else:
+            logger.debug('Directory %s already exists. Skipping creation.', dirname)
+    elif check_dir_exists(dirname, dryrun=dryrun):
         logger.debug('Directory %s already exists. Skipping creation.', dirname)
     elif skip_confirm or confirm("Create directory '{0}'?".format(dirname), default=True):
         logger.info("Creating directory '%s'", dirname)
@@ -38,6 +76,7 @@ def create_dir(dirname: str, dryrun: bool = True, skip_confirm: bool = False) ->
                          "directory '%s', but will continue.", dirname)
         else:
             os.mkdir(dirname)
+            clear_stat_cache(dirname)
         directory_created = True
 
     return directory_created
@@ -61,8 +100,6 @@ def create_dirstriped_dir(dirname: str,
     Will return True, if directory has been created.
     """
 
-    logger = get_logger()
-
     directory_created = False
 
     if check_dir_exists(dirname, dryrun=dryrun):
@@ -96,6 +133,7 @@ def create_dirstriped_dir(dirname: str,
         else:
             logger.info("Creating dirstriped directory: '%s'", dirname)
             lfs('setdirstripe', '-c', dirstripes, '-i', '-1', dirname)
+            clear_stat_cache(dirname)
 
         directory_created = True
     return directory_created
@@ -103,31 +141,31 @@ def create_dirstriped_dir(dirname: str,
 def set_dir_owner(dirname: str,
                   user_name: str,
                   dryrun: bool = True,
-                  skip_confirm: bool = False) -> bool:
-
-    logger = get_logger()
+                  skip_confirm: bool = False,
+                  context: DirContext = None,
+                  prevalidated: bool = False) -> bool:
 
     ownership_set = False
 
-    try:
-        assert check_dir_exists(dirname, dryrun=dryrun), \
-            "Cannot set ownership for directory {0}, it does not exist!".format(dirname)
-    except AssertionError as error:
-        if dryrun:
-            logger.debug(("Got an error '%s' with directory '%s', but will "
-                          "continue due to dry-run."), error, dirname)
-        else:
-            raise error
-
-    user_id = generate_project_id(user_name, dryrun=dryrun)
-
-    current_uid = get_dir_uid(dirname)
-
-    if current_uid == user_id:
+    if not prevalidated:
+        try:
+            assert check_dir_exists(dirname, dryrun=dryrun), \
+                "Cannot set ownership for directory {0}, it does not exist!".format(dirname)
+        except AssertionError as error:
+            if dryrun:
+                logger.debug(("Got an error '%s' with directory '%s', but will "
+                              "continue due to dry-run."), error, dirname)
+            else:
+                raise error
+
+    if context is None:
+        context = get_dir_context(dirname, user_name, dryrun=dryrun)
+
+    if context.uid == context.project_id:
         logger.debug(
             "Directory '%s' has correct group ownership.",
             dirname)
-    elif skip_confirm or confirm(("Setting user ownership with the following command:\n\n"
+    elif dryrun or skip_confirm or confirm(("Setting user ownership with the following command:\n\n"
                   "chown -h {0} {1}\n\n"
                   "Is this ok?").format(user_name, dirname), default=True):
         if dryrun:
@@ -137,7 +175,8 @@ def set_dir_owner(dirname: str,
                 dirname)
         else:
             logger.info("Setting ownership for directory: '%s'", dirname)
-            chown('-h', user_name, dirname)
+            os.chown(dirname, get_user_id(user_name), -1, follow_symlinks=False)
+            clear_stat_cache(dirname)
 
         ownership_set = True
 
@@ -146,33 +185,84 @@ def set_dir_owner(dirname: str,
 def set_dir_group(dirname: str,
                   group_name: str,
                   dryrun: bool = True,
-                  skip_confirm: bool = False) -> bool:
-
-    logger = get_logger()
+                  skip_confirm: bool = False,
+                  context: DirContext = None,
+                  prevalidated: bool = False) -> bool:
 
     ownership_set = False
 
-    try:
-        assert check_dir_exists(dirname, dryrun=dryrun), \
-            "Cannot set ownership for directory {0}, it does not exist!".format(dirname)
-    except AssertionError as error:
+    if not prevalidated:
+        try:
+            assert check_dir_exists(dirname, dryrun=dryrun), \
+                "Cannot set ownership for directory {0}, it does not exist!".format(dirname)
+        except AssertionError as error:
+            if dryrun:
+                logger.debug(("Got an error '%s' with directory '%s', but will "
+                              "continue due to dry-run."), error, dirname)
+            else:
+                raise error
+
+    if context is None:
+        context = get_dir_context(dirname, group_name, dryrun=dryrun)
+
+    if context.gid == context.project_id:
+        logger.debug(
+            "Directory '%s' has correct group ownership.",
+            dirname)
+    elif dryrun or skip_confirm or confirm(("Setting group ownership with the following command:\n\n"
+                  "chgrp -h {0} {1}\n\n"
+                  "Is this ok?").format(group_name, dirname), default=True):
         if dryrun:
-            logger.debug(("Got an error '%s' with directory '%s', but will "
-                          "continue due to dry-run."), error, dirname)
+            logger.debug(
+                ("Dry run enabled, will not set ownership for "
+                 "directory '%s', but will continue."),
+                dirname)
         else:
-            raise error
+            logger.info("Setting ownership for directory: '%s'", dirname)
+            os.chown(dirname, -1, get_group_id(group_name), follow_symlinks=False)
+            clear_stat_cache(dirname)
 
-    group_id = generate_project_id(group_name, dryrun=dryrun)
+        ownership_set = True
 
-    current_gid = get_dir_gid(dirname)
+    return ownership_set
+
+def set_dir_ownership(dirname: str,
+                      user_name: str,
+                      group_name: str,
+                      dryrun: bool = True,
+                      skip_confirm: bool = False,
+                      context: DirContext = None,
+                      prevalidated: bool = False) -> bool:
+    """ This function sets both user and group ownership of a directory
+    with a single chown. """
+
+    ownership_set = False
 
-    if current_gid == group_id:
+    if not prevalidated:
+        try:
+            assert check_dir_exists(dirname, dryrun=dryrun), \
+                "Cannot set ownership for directory {0}, it does not exist!".format(dirname)
+        except AssertionError as error:
+            if dryrun:
+                logger.debug(("Got an error '%s' with directory '%s', but will "
+                              "continue due to dry-run."), error, dirname)
+            else:
+                raise error
+
+    if context is None:
+        context = get_dir_context(dirname, group_name, dryrun=dryrun)
+
+    user_id = context.project_id
+    if user_name != group_name:
+        user_id = generate_project_id(user_name, dryrun=dryrun)
+
+    if context.uid == user_id and context.gid == context.project_id:
         logger.debug(
-            "Directory '%s' has correct group ownership.",
+            "Directory '%s' has correct user and group ownership.",
             dirname)
-    elif skip_confirm or confirm(("Setting group ownership with the following command:\n\n"
-                  "chgrp -h {0} {1}\n\n"
-                  "Is this ok?").format(group_name, dirname), default=True):
+    elif dryrun or skip_confirm or confirm(("Setting user and group ownership with the following command:\n\n"
+                  "chown -h {0}:{1} {2}\n\n"
+                  "Is this ok?").format(user_name, group_name, dirname), default=True):
         if dryrun:
             logger.debug(
                 ("Dry run enabled, will not set ownership for "
@@ -180,7 +270,9 @@ def set_dir_group(dirname: str,
                 dirname)
         else:
             logger.info("Setting ownership for directory: '%s'", dirname)
-            chgrp(group_name, dirname)
+            os.chown(dirname, get_user_id(user_name), get_group_id(group_name),
+                     follow_symlinks=False)
+            clear_stat_cache(dirname)
 
         ownership_set = True
 
@@ -189,28 +281,30 @@ def set_dir_group(dirname: str,
 def set_dir_permissions(dirname: str,
                         permissions: str,
                         dryrun: bool = True,
-                        skip_confirm: bool = False) -> bool:
-
-    logger = get_logger()
+                        skip_confirm: bool = False,
+                        context: DirContext = None,
+                        prevalidated: bool = False) -> bool:
 
     permissions_set = False
 
-    try:
-        assert check_dir_exists(dirname, dryrun=dryrun), \
-            "Cannot set ownership for directory {0}, it does not exist!".format(dirname)
-    except AssertionError as error:
-        if dryrun:
-            logger.debug(("Got an error '%s' with directory '%s', but will "
-                          "continue due to dry-run."), error, dirname)
+    if not prevalidated:
+        try:
+            assert check_dir_exists(dirname, dryrun=dryrun), \
+                "Cannot set ownership for directory {0}, it does not exist!".format(dirname)
+        except AssertionError as error:
+            if dryrun:
+                logger.debug(("Got an error '%s' with directory '%s', but will "
+                              "continue due to dry-run."), error, dirname)
     
 
-    current_permissions = get_dir_permissions(dirname)
-    
-    if current_permissions == permissions:
+    if context is None:
+        context = get_dir_context(dirname, dryrun=dryrun)
+
+    if context.mode == int(permissions, 8):
         logger.debug(
             "Directory '%s' has correct permissions.",
             dirname)
-    elif skip_confirm or confirm(("Setting permissions with the following command:\n\n"
+    elif dryrun or skip_confirm or confirm(("Setting permissions with the following command:\n\n"
                   "chmod {0} {1}\n\n"
                   "Is this ok?").format(permissions, dirname), default=True):
         if dryrun:
@@ -220,7 +314,8 @@ def set_dir_permissions(dirname: str,
                 dirname)
         else:
             logger.info("Setting permissions for directory: '%s'", dirname)
-            chmod(permissions, dirname)
+            os.chmod(dirname, int(permissions, 8))
+            clear_stat_cache(dirname)
 
         permissions_set = True
 
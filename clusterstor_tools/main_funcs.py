@@ -1,69 +1,137 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Tuple
+
 from clusterstor_tools.common import (
-    catch_interrupt, print_smallheader)
+    assume_yes, catch_interrupt, clear_stat_cache, logger, print_smallheader)
 from clusterstor_tools.dir_ops import (
-    create_dir, set_dir_owner, set_dir_group, set_dir_permissions)
+    create_dir, get_dir_context, set_dir_ownership, set_dir_group,
+    set_dir_permissions)
 from clusterstor_tools.stripe_ops import set_striping, compare_striping
 from clusterstor_tools.quota_ops import (
-    set_project_id, verify_set_project_id,
+    get_project_ids, set_project_id, verify_set_project_id,
     set_project_quota, verify_project_quota)
+from clusterstor_tools.siteconfig import get_project_dirs, get_work_dirs
 
-@catch_interrupt
-def create_project_dir(project_info: dict = None,
-                       redo_striping: bool = None,
-                       redo_project_ids: bool = None,
-                       redo_quotas: bool = None,
-                       redo_ownerships: bool = None,
-                       strict_project_checking: bool = None,
-                       dryrun: bool = True) -> None:
-    """ Create project directory. """
+def _create_managed_dir(dir_info: dict,
+                        kind: str,
+                        ensure_owner: bool = False,
+                        redo_striping: bool = None,
+                        redo_project_ids: bool = None,
+                        redo_quotas: bool = None,
+                        redo_ownerships: bool = None,
+                        strict_project_checking: bool = None,
+                        dryrun: bool = True,
+                        project_ids: Dict[str, Tuple[int, bool]] = None) -> None:
+    """ Creates a project or work directory described by dir_info and
+    sets its striping, project ID, ownerships, permissions and quota.
+
+    If ensure_owner is set, user ownership is set together with the group
+    ownership. Project IDs prefetched with get_project_ids can be given
+    with project_ids.
+    """
     print_smallheader(
-        "Working with project: '{0}'".format(project_info['name']))
+        "Working with {0}: '{1}'".format(kind, dir_info['name']))
+    # Mismatches must not wait for input, if directories are
+    # processed in parallel
+    pause = not assume_yes()
+    project_id_info = None
+    if project_ids:
+        project_id_info = project_ids.get(os.path.normpath(dir_info['path']))
+    clear_stat_cache(dir_info['path'])
     directory_created = create_dir(
-        project_info['path'],
+        dir_info['path'],
+        dryrun=dryrun)
+    context = get_dir_context(
+        dir_info['path'],
+        dir_info['name'],
         dryrun=dryrun)
     if (directory_created or
         (redo_striping and
          not compare_striping(
-                project_info['path'],
-                project_info['stripe_parameter_reference']))):
+                dir_info['path'],
+                dir_info['stripe_parameter_reference'],
+                prevalidated=context.exists,
+                pause=pause))):
             set_striping(
-                project_info['path'],
-                project_info['stripe_parameters'],
+                dir_info['path'],
+                dir_info['stripe_parameters'],
                 dryrun=dryrun)
     if (directory_created or
         (redo_project_ids and
          not verify_set_project_id(
-                project_info['path'],
+                dir_info['path'],
                 strict=strict_project_checking,
-                dryrun=dryrun))):
+                dryrun=dryrun,
+                project_id=context.project_id,
+                pause=pause,
+                project_id_info=project_id_info))):
         set_project_id(
-            project_info['path'],
-            project_info['name'],
-            dryrun=dryrun)
+            dir_info['path'],
+            dir_info['name'],
+            dryrun=dryrun,
+            project_id=context.project_id)
     if (directory_created or redo_ownerships):
-        set_dir_group(
-            project_info['path'],
-            project_info['name'],
-            dryrun=dryrun)
+        if ensure_owner:
+            set_dir_ownership(
+                dir_info['path'],
+                dir_info['name'],
+                dir_info['name'],
+                dryrun=dryrun,
+                context=context,
+                prevalidated=context.exists)
+        else:
+            set_dir_group(
+                dir_info['path'],
+                dir_info['name'],
+                dryrun=dryrun,
+                context=context,
+                prevalidated=context.exists)
         set_dir_permissions(
-            project_info['path'],
-            project_info['permissions'],
-            dryrun=dryrun)
+            dir_info['path'],
+            dir_info['permissions'],
+            dryrun=dryrun,
+            context=context,
+            prevalidated=context.exists)
     if (directory_created or
         (redo_quotas and
          not verify_project_quota(
-            project_info['path'],
-            project_info['name'],
-            project_info['quota'],
-            dryrun=dryrun))):
+            dir_info['path'],
+            dir_info['name'],
+            dir_info['quota'],
+            dryrun=dryrun,
+            project_id=context.project_id))):
         set_project_quota(
-            project_info['path'],
-            project_info['name'],
-            project_info['quota'],
-            dryrun=dryrun)
+            dir_info['path'],
+            dir_info['name'],
+            dir_info['quota'],
+            dryrun=dryrun,
+            project_id=context.project_id)
+
+@catch_interrupt
+def create_project_dir(project_info: dict = None,
+                       redo_striping: bool = None,
+                       redo_project_ids: bool = None,
+                       redo_quotas: bool = None,
+                       redo_ownerships: bool = None,
+                       strict_project_checking: bool = None,
+                       dryrun: bool = True,
+                       project_ids: Dict[str, Tuple[int, bool]] = None) -> None:
+    """ Create project directory. """
+    _create_managed_dir(
+        project_info,
+        'project',
+        ensure_owner=False,
+        redo_striping=redo_striping,
+        redo_project_ids=redo_project_ids,
+        redo_quotas=redo_quotas,
+        redo_ownerships=redo_ownerships,
+        strict_project_checking=strict_project_checking,
+        dryrun=dryrun,
+        project_ids=project_ids)
 
 @catch_interrupt
 def create_work_dir(workdir_info: dict = None,
@@ -73,61 +141,98 @@ def create_work_dir(workdir_info: dict = None,
                     redo_ownerships: bool = None,
                     strict_project_checking: bool = None,
                     dryrun: bool = True,
-                    skip_confirm: bool = False) -> None:
+                    project_ids: Dict[str, Tuple[int, bool]] = None) -> None:
     """ Creates a work directory for user. """
-    print_smallheader(
-        "Working with user: '{0}'".format(workdir_info['name']))
-    directory_created = create_dir(
-        workdir_info['path'],
+    _create_managed_dir(
+        workdir_info,
+        'user',
+        ensure_owner=True,
+        redo_striping=redo_striping,
+        redo_project_ids=redo_project_ids,
+        redo_quotas=redo_quotas,
+        redo_ownerships=redo_ownerships,
+        strict_project_checking=strict_project_checking,
         dryrun=dryrun,
-        skip_confirm=skip_confirm)
-    if (directory_created or
-        (redo_striping and
-         not compare_striping(
-                workdir_info['path'],
-                workdir_info['stripe_parameter_reference']))):
-            set_striping(
-                workdir_info['path'],
-                workdir_info['stripe_parameters'],
-                dryrun=dryrun,
-                skip_confirm=skip_confirm)
-    if (directory_created or
-        (redo_project_ids and
-         not verify_set_project_id(
-                workdir_info['path'],
-                strict=strict_project_checking,
-                dryrun=dryrun))):
-        set_project_id(
-            workdir_info['path'],
-            workdir_info['name'],
-            dryrun=dryrun,
-            skip_confirm=skip_confirm)
-    if (directory_created or redo_ownerships):
-        set_dir_owner(
-            workdir_info['path'],
-            workdir_info['name'],
-            dryrun=dryrun,
-            skip_confirm=skip_confirm)
-        set_dir_group(
-            workdir_info['path'],
-            workdir_info['name'],
-            dryrun=dryrun,
-            skip_confirm=skip_confirm)
-        set_dir_permissions(
-            workdir_info['path'],
-            workdir_info['permissions'],
-            dryrun=dryrun,
-            skip_confirm=skip_confirm)
-    if (directory_created or
-        (redo_quotas and
-         not verify_project_quota(
-            workdir_info['path'],
-            workdir_info['name'],
-            workdir_info['quota'],
-            dryrun=dryrun))):
-        set_project_quota(
-            workdir_info['path'],
-            workdir_info['name'],
-            workdir_info['quota'],
-            dryrun=dryrun,
-            skip_confirm=skip_confirm)
+        project_ids=project_ids)
+
+def for_each_dir(func: Callable[..., Any],
+                 dir_infos: Iterable[dict],
+                 workers: int = 1,
+                 **kwargs) -> None:
+    """ This function runs func (e.g. create_project_dir) for each directory information
+    dictionary in dir_infos. Other keyword arguments are given to func.
+
+    If workers is greater than one, directories are processed in parallel
+    with a thread pool. As prompts cannot be interleaved, this requires
+    confirmations to be skipped (see common.assume_yes).
+    """
+
+    if workers > 1 and not assume_yes():
+        logger.warning("Parallel processing requires skipping confirmations. "
+                       "Processing directories one at a time.")
+        workers = 1
+
+    if workers <= 1:
+        for dir_info in dir_infos:
+            func(dir_info, **kwargs)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(func, dir_info, **kwargs) for dir_info in dir_infos]
+        try:
+            for future in futures:
+                future.result()
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+
+def verify_all(site_config: dict,
+               workers: int = 16,
+               strict_project_checking: bool = False) -> bool:
+    """ This function verifies striping, project IDs and quotas of all
+    project and work directories without making any changes.
+
+    Checks are independent, so they are run in parallel with a thread pool
+    of the given size. Returns True if every check passed.
+    """
+
+    dir_infos = list(get_project_dirs(site_config)) + list(get_work_dirs(site_config))
+
+    # Query all project ids up front instead of running lfs per directory
+    project_ids = get_project_ids([dir_info['path'] for dir_info in dir_infos])
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        futures = {}
+        for dir_info in dir_infos:
+            path = dir_info['path']
+            futures[path] = [
+                executor.submit(
+                    compare_striping,
+                    path,
+                    dir_info['stripe_parameter_reference'],
+                    pause=False),
+                executor.submit(
+                    verify_set_project_id,
+                    path,
+                    strict=strict_project_checking,
+                    pause=False,
+                    project_id_info=project_ids.get(os.path.normpath(path))),
+                executor.submit(
+                    verify_project_quota,
+                    path,
+                    dir_info['name'],
+                    dir_info['quota'],
+                    dryrun=True),
+            ]
+        failed_dirs = [path for path, checks in futures.items()
+                       if not all(check.result() for check in checks)]
+
+    if failed_dirs:
+        logger.warning("Verification failed for %d of %d directories:\n%s",
+                       len(failed_dirs), len(dir_infos), '\n'.join(failed_dirs))
+    else:
+        logger.info("All %d directories verified successfully.", len(dir_infos))
+
+    return not failed_dirs
@@ -5,40 +5,72 @@ This file contains functions that check and modify the project quotas.
 
 import os
 import re
-import sys
-from typing import Tuple
-
-try:
-    from sh import lfs
-    from sh import ErrorReturnCode
-except ModuleNotFoundError:
-    print("python3 sh-module is missing. Please install it with:\n\n"
-          "yum install python36-sh")
-    sys.exit(1)
-
+from functools import lru_cache
+from subprocess import CalledProcessError
+from typing import Dict, List, Optional, Tuple
 
 from clusterstor_tools.common import (
-    confirm, get_logger, pause_until_input, print_warning, get_group_id)
+    confirm, pause_until_input, print_warning, get_group_id,
+    lfs, logger, CACHE_SIZE, WARNING_LOCK)
 
 
 DEFAULT_QUOTADICT = {'byte_quota': '0', 'inode_quota': '0'}
-QUOTA_REGEX = re.compile(r'^(?P<value>(\d|\.)+)(?P<suffix>[kMGTPE]?)(?P<asterisk>[*]?)$')
+QUOTA_KEYS = frozenset(DEFAULT_QUOTADICT)
+QUOTA_REGEX = re.compile(r'^(?P<value>(\d|\.)+)(?P<suffix>[kMGTPE]?)(?P<asterisk>[*]?)$', re.ASCII)
+SUFFIX_SHIFTS = {'': 0, 'k': 10, 'M': 20, 'G': 30, 'T': 40, 'P': 50, 'E': 60}
+QUOTA_NUMBER_CHARS = '0123456789.'
+# Matches the last line of 'lfs quota -q' output. The filesystem path may
+# be in front of the fields, so the eight fields are matched from the end:
+# used, quota, limit, grace, files, quota, limit, grace
+QUOTA_OUTPUT_REGEX = re.compile(
+    r'(\S+)\s+(\S+)\s+\S+\s+\S+\s+(\S+)\s+(\S+)\s+\S+\s+\S+\s*\Z', re.ASCII)
+# Maximum number of directories given to a single 'lfs project -d' call
+PROJECT_ID_BATCH_SIZE = 256
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def parse_quotavalue(quotavalue: str) -> Optional[Tuple[int, bool]]:
+    """ This helper function converts a quota value to an absolute number.
+    Returns the number and whether the value had an asterisk, or None if
+    the value is invalid. Outputs are cached. """
+
+    # Split the value by hand, as the values are short and the regex is
+    # only needed for strings that are not plain numbers with a suffix.
+    asterisk = '*' if quotavalue.endswith('*') else ''
+    end = len(quotavalue) - len(asterisk)
+    suffix = quotavalue[end - 1:end]
+    if suffix in SUFFIX_SHIFTS:
+        end -= len(suffix)
+    else:
+        suffix = ''
+    value = quotavalue[:end]
+
+    if not value or value.strip(QUOTA_NUMBER_CHARS):
+        quotamatch = QUOTA_REGEX.match(quotavalue)
+
+        if quotamatch is None:
+            return None
+
+        value, suffix, asterisk = quotamatch.group('value', 'suffix', 'asterisk')
+
+    try:
+        absolute_value = int(float(value) * (1 << SUFFIX_SHIFTS[suffix]))
+    except ValueError:
+        return None
+
+    return (absolute_value, asterisk == '*')
 
 
 def check_quotavalue(quotavalue: str) -> bool:
     """ This helper function checks that a string is a proper quota value. """
 
-    quotamatch = QUOTA_REGEX.match(quotavalue)
-
-    return quotamatch is not None
+    return parse_quotavalue(quotavalue) is not None
 
 
 def check_quotadict(quotadict: dict) -> bool:
     """ This helper function checks that a dictionary is
     a proper quota dictionary. """
 
-    logger = get_logger()
-
     try:
         assert 'byte_quota' in quotadict, \
             "'byte_quota' is missing from the quotadict"
@@ -56,8 +88,9 @@ def check_quotadict(quotadict: dict) -> bool:
         assert check_quotavalue(inode_quota), \
             "'inode_quota' is of invalid format: {0}".format(inode_quota)
 
-        assert len(quotadict) == 2, \
-            "Quota dict has extraneous keys: '{0}'".format([quotadict.keys()])
+        assert QUOTA_KEYS.issuperset(quotadict), \
+            "Quota dict has extraneous keys: '{0}'".format(
+                sorted(set(quotadict) - QUOTA_KEYS))
 
     except AssertionError as error:
         logger.error(
@@ -68,28 +101,28 @@ def check_quotadict(quotadict: dict) -> bool:
     return True
 
 
-def get_absolute_quotadict(quotadict: dict) -> dict:
-    """ This helper function converts quota dictionary the absolute numbers. """
+def get_absolute_quotavalue(quotavalue: str) -> int:
+    """ This helper function converts a quota value to an absolute number.
+    Raises ValueError if the value is invalid. """
 
-    abs_quotadict = DEFAULT_QUOTADICT.copy()
+    parsed_quota = parse_quotavalue(str(quotavalue))
+    if parsed_quota is None:
+        raise ValueError("Invalid quota value '{0}'".format(quotavalue))
+    return parsed_quota[0]
 
-    suffixmap = {
-        '': 1,
-        'k': 1024,
-        'M': 1024**2,
-        'G': 1024**3,
-        'T': 1024**4,
-        'P': 1024**5,
-        'E': 1024**6,
-    }
 
-    for key in ('byte_quota', 'inode_quota'):
-        quotastr = str(quotadict[key])
+def get_absolute_quotadict(quotadict: dict, as_str: bool = True) -> dict:
+    """ This helper function converts quota dictionary the absolute numbers.
+    The numbers are given as strings, unless as_str is False. """
+
+    abs_quotadict = DEFAULT_QUOTADICT.copy()
+
+    for key in DEFAULT_QUOTADICT:
         try:
-            quotamatch = QUOTA_REGEX.match(quotastr).groupdict()
-            abs_quotadict[key] = str(int(float(quotamatch['value']) * suffixmap[quotamatch['suffix']]))
-        except AttributeError:
-            raise Exception("Problem matching quotastr '%s' from quotadict '%s'" % (quotastr, quotadict))
+            abs_quota = get_absolute_quotavalue(quotadict[key])
+        except ValueError:
+            raise Exception("Problem matching quotastr '%s' from quotadict '%s'" % (quotadict[key], quotadict))
+        abs_quotadict[key] = str(abs_quota) if as_str else abs_quota
 
     return abs_quotadict
 
@@ -97,12 +130,14 @@ def get_absolute_quotadict(quotadict: dict) -> dict:
 def initialize_quotadict(quotadict: dict, defaults: dict) -> dict:
     """ This helper function initializes a quotadict with defaults. """
 
-    updated_quotadict = defaults.copy()
-    updated_quotadict.update(quotadict)
+    updated_quotadict = {
+        key: str(quotadict.get(key, defaults[key])) for key in DEFAULT_QUOTADICT
+    }
 
-    # Make all arguments strings
-    for key in updated_quotadict:
-        updated_quotadict[key] = str(updated_quotadict[key])
+    # Keep unknown keys so that check_quotadict can report them
+    if not QUOTA_KEYS.issuperset(quotadict):
+        updated_quotadict.update(
+            (key, str(value)) for key, value in quotadict.items())
 
     return updated_quotadict
 
@@ -110,8 +145,6 @@ def initialize_quotadict(quotadict: dict, defaults: dict) -> dict:
 def generate_project_id(group_name: str, dryrun: bool = True) -> int:
     """ This function will generate a project ID that matches groups GID. """
 
-    logger = get_logger()
-
     logger.debug("Checking group id for group '%s'.", group_name)
 
     group_id = 0
@@ -133,8 +166,6 @@ def generate_project_id(group_name: str, dryrun: bool = True) -> int:
 def get_project_id(dirname: str, dryrun: bool = True) -> Tuple[int, str]:
     """ This function will get a project id of a folder. """
 
-    logger = get_logger()
-
     logger.debug("Checking project id for directory '%s'.", dirname)
 
     project_id = -1
@@ -154,15 +185,44 @@ def get_project_id(dirname: str, dryrun: bool = True) -> Tuple[int, str]:
 
     return (project_id, inheritance)
 
+
+def get_project_ids(dirnames: List[str]) -> Dict[str, Tuple[int, bool]]:
+    """ This function will get project ids of multiple folders with one
+    lfs call per batch of directories.
+
+    Returns a dictionary from normalized directory paths to
+    (project_id, inheritance)-tuples. Directories that could not be
+    checked are left out of the dictionary. """
+
+    project_ids = {}
+    for start in range(0, len(dirnames), PROJECT_ID_BATCH_SIZE):
+        batch = dirnames[start:start + PROJECT_ID_BATCH_SIZE]
+        try:
+            lfs_output = lfs('project', '-d', *batch)
+        except CalledProcessError as error:
+            # lfs continues past directories it cannot check, so the
+            # output still contains the project ids of the other ones.
+            logger.debug("Could not check project ids of all directories: %s", error)
+            lfs_output = error.output or ''
+        for line in lfs_output.splitlines():
+            fields = line.split(None, 2)
+            if len(fields) != 3 or not fields[0].isdigit():
+                continue
+            project_ids[os.path.normpath(fields[2])] = (int(fields[0]), fields[1] == 'P')
+
+    return project_ids
+
+
 def set_project_id(dirname: str,
                    group_name: int,
                    dryrun: bool = True,
-                   skip_confirm: bool = False) -> None:
-    """ This function will set the project ID on a folder based on group name. """
+                   skip_confirm: bool = False,
+                   project_id: int = None) -> None:
+    """ This function will set the project ID on a folder based on group name.
+    An already resolved project ID can be given with project_id. """
 
-    logger = get_logger()
-
-    project_id = generate_project_id(group_name, dryrun=dryrun)
+    if project_id is None:
+        project_id = generate_project_id(group_name, dryrun=dryrun)
 
     if skip_confirm or confirm(("Setting project ID of directory '{0}' to '{1}' with the "
                 "following command:\n\n"
@@ -190,21 +250,32 @@ def set_project_id(dirname: str,
 
 def verify_set_project_id(dirname: str,
                           strict: bool = False,
-                          dryrun: bool = True) -> bool:
+                          dryrun: bool = True,
+                          project_id: int = None,
+                          pause: bool = True,
+                          project_id_info: Tuple[int, bool] = None) -> bool:
     """ This function will check that project ID has been set
     with an inheritance flag.
 
-    In strict mode, project ID is compared against actual group ID.
+    In strict mode, project ID is compared against actual group ID
+    (or against project_id, if it is given).
     Otherwise, project ID that is greater than 0 passes.
-    """
 
-    logger = get_logger()
+    An already queried (project_id, inheritance)-tuple, e.g. from
+    get_project_ids, can be given with project_id_info.
+
+    On mismatch, execution is paused if pause is set.
+    """
 
-    current_project_id, inheritance = get_project_id(dirname, dryrun)
+    if project_id_info is None:
+        project_id_info = get_project_id(dirname, dryrun)
+    current_project_id, inheritance = project_id_info
 
     if strict:
-        project_name = os.path.basename(dirname)
-        reference_project_id = generate_project_id(project_name, dryrun)
+        reference_project_id = project_id
+        if reference_project_id is None:
+            project_name = os.path.basename(dirname)
+            reference_project_id = generate_project_id(project_name, dryrun)
         project_id_set = current_project_id == reference_project_id and inheritance
     else:
         project_id_set = current_project_id > 0 and inheritance
@@ -215,14 +286,16 @@ def verify_set_project_id(dirname: str,
             "Directory '%s' has a project ID and inheritance set",
             dirname)
     else:
-        print_warning("Project ID mismatch")
-        logger.warning(("Project ID on directory '%s' does not seem to be "
-                        "set correctly:\n\n"
-                        "Project ID: %s\nInheritance: %s\n"),
-                       dirname,
-                       current_project_id,
-                       inheritance)
-        pause_until_input()
+        with WARNING_LOCK:
+            print_warning("Project ID mismatch")
+            logger.warning(("Project ID on directory '%s' does not seem to be "
+                            "set correctly:\n\n"
+                            "Project ID: %s\nInheritance: %s\n"),
+                           dirname,
+                           current_project_id,
+                           inheritance)
+        if pause:
+            pause_until_input()
 
     return project_id_set
 
@@ -231,12 +304,12 @@ def set_project_quota(dirname: str,
                       group_name: str,
                       quotadict: dict,
                       dryrun: bool = False,
-                      skip_confirm: bool = False) -> bool:
+                      skip_confirm: bool = False,
+                      project_id: int = None) -> bool:
     """ This function sets quota for a project. """
 
-    logger = get_logger()
-
-    project_id = generate_project_id(group_name, dryrun)
+    if project_id is None:
+        project_id = generate_project_id(group_name, dryrun)
 
     quota_set = False
 
@@ -277,8 +350,6 @@ def get_project_quotadict(dirname: str, project_id: int, dryrun: bool = True) ->
     """ This function gets quota for a project and will return the output as
     a quotadict. """
 
-    logger = get_logger()
-    
     logger.debug("Checking quota for project id '%d'.", project_id)
 
     quotadict = DEFAULT_QUOTADICT.copy()
@@ -292,14 +363,15 @@ def get_project_quotadict(dirname: str, project_id: int, dryrun: bool = True) ->
             quotadict['inode_quota'] = 0
             logger.debug('Default quota was still set, interpreting as no quota set!')
         else:
-            quota_output = quota_cmd_output.replace(dirname, '')
-            quota_output = quota_output.splitlines()[-1].split()
-            quotadict['byte_usage'] = quota_output[0]
-            quotadict['byte_quota'] = quota_output[1]
-            quotadict['inode_usage'] = quota_output[4]
-            quotadict['inode_quota'] = quota_output[5]
-        logger.debug(('Found the following quota: '
-                      ' %s ') % quotadict)
+            quota_output = quota_cmd_output.rstrip()
+            match = QUOTA_OUTPUT_REGEX.search(
+                quota_output, quota_output.rfind('\n') + 1)
+            if match is None:
+                raise ValueError(
+                    "Could not parse quota output: {0}".format(quota_cmd_output))
+            (quotadict['byte_usage'], quotadict['byte_quota'],
+             quotadict['inode_usage'], quotadict['inode_quota']) = match.groups()
+        logger.debug('Found the following quota: %s', quotadict)
     except Exception as error:
         if dryrun:
             logger.debug(error)
@@ -315,15 +387,15 @@ def get_project_quotadict(dirname: str, project_id: int, dryrun: bool = True) ->
 def verify_project_quota(dirname: str,
                          group_name: str,
                          quotadict: dict,
-                         dryrun: bool = False) -> bool:
+                         dryrun: bool = False,
+                         project_id: int = None) -> bool:
     """ This function verifies that the quota for a project has been
     set correctly. """
     
-    logger = get_logger()
-    
     logger.debug("Verifying quota for project '%s'.", group_name)
 
-    project_id = generate_project_id(group_name, dryrun)
+    if project_id is None:
+        project_id = generate_project_id(group_name, dryrun)
 
     quota_correct = False
 
@@ -334,8 +406,8 @@ def verify_project_quota(dirname: str,
         set_quotadict = get_project_quotadict(dirname, project_id, dryrun)
 
         # Normalize quotadicts
-        abs_quotadict = get_absolute_quotadict(quotadict)
-        abs_set_quotadict = get_absolute_quotadict(set_quotadict)
+        abs_quotadict = get_absolute_quotadict(quotadict, as_str=False)
+        abs_set_quotadict = get_absolute_quotadict(set_quotadict, as_str=False)
 
         quota_correct = (
             abs_quotadict['byte_quota'] == abs_set_quotadict['byte_quota'] and
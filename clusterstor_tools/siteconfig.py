@@ -2,9 +2,12 @@
 """
 This file contains functions that read the site configuration file.
 """
+import copy
 import os
+import stat
 import sys
-from typing import Iterator
+from functools import lru_cache
+from typing import Dict, Iterator, NamedTuple, Tuple
 """
 try:
     from yaml import load, dump
@@ -24,25 +27,61 @@ except ModuleNotFoundError:
 
 
 from clusterstor_tools.common import (
-  confirm, get_logger, get_group_users, get_group_id )
+  confirm, get_group_users, get_group_id, logger, preload_group_ids )
 from clusterstor_tools.dir_ops import check_dir_exists
 from clusterstor_tools.quota_ops import check_quotadict, initialize_quotadict
 
-def read_config(conf_filename: str) -> dict:
-    """ This function loads a configuration from an yaml file."""
-    with open(conf_filename, 'r') as conf_file:
-        yaml_loader = YAML()
+@lru_cache(maxsize=2)
+def get_yaml_loader(preserve_comments: bool = False) -> YAML:
+    """ This helper function provides a shared YAML loader.
+
+    The safe loader uses the libyaml C parser when it is available. The
+    round-trip loader is only needed when the configuration is written
+    back, as it preserves comments."""
+
+    if not preserve_comments:
+        try:
+            return YAML(typ='safe')
+        except Exception as error:
+            logger.debug(
+                "Could not create a safe YAML loader, using the "
+                "round-trip loader instead: %s", error)
+    return YAML()
+
+
+def read_config(conf_filename: str,
+                preserve_comments: bool = False,
+                mutable: bool = False) -> dict:
+    """ This function loads a configuration from an yaml file.
+
+    Set preserve_comments if the configuration will be written back with
+    write_config. The loaded configuration is cached and shared between
+    calls, so set mutable if the returned configuration will be modified."""
+    conf_path = os.path.abspath(conf_filename)
+    conf_stat = os.stat(conf_path)
+    conf = read_config_cached(
+        conf_path, preserve_comments, conf_stat.st_mtime_ns, conf_stat.st_size)
+    if mutable:
+        conf = copy.deepcopy(conf)
+    return conf
+
+
+@lru_cache(maxsize=4)
+def read_config_cached(conf_path: str, preserve_comments: bool,
+                       mtime_ns: int, size: int) -> dict:
+    """ This helper function loads a configuration from an yaml file.
+    The result is cached by path, modification time and size."""
+    yaml_loader = get_yaml_loader(preserve_comments)
+    with open(conf_path, 'r') as conf_file:
         conf = yaml_loader.load(conf_file)
     assert conf is not None, \
-        "Problem loading configuration: Configuration file '{0}' was empty!".format(conf_filename)
+        "Problem loading configuration: Configuration file '{0}' was empty!".format(conf_path)
     return conf
 
 
 def write_config(conf_filename: str, config: YAML, dryrun: bool = True, skip_confirm: bool = False) -> bool:
     """ This function writes configuration to an yaml file."""
     
-    logger = get_logger()
-    
     assert isinstance(config, CommentedMap), \
            "Config should be a ruamel.yaml.comments.CommentedMap instance to preserve comments"
     
@@ -62,6 +101,24 @@ def write_config(conf_filename: str, config: YAML, dryrun: bool = True, skip_con
     return write_file
 
 
+class Defaults(NamedTuple):
+    """ This class holds the validated 'defaults' of a site configuration."""
+    mountpoint: str
+    users_group: str
+    work_dir_name: str
+    dirstripe_count: int
+    stripe_parameters: str
+    stripe_parameter_reference: str
+    default_quotas: dict
+    default_project_quotas: dict
+    default_workdir_quotas: dict
+
+
+# Validated defaults by id(site_config). The config itself is stored as
+# well so that the id cannot be reused by another object.
+DEFAULTS_CACHE = {}  # type: Dict[int, Tuple[dict, Defaults]]
+
+
 def get_defaults(site_config: dict) -> dict:
     """ This function will provide the 'defaults' of the site configuration."""
 
@@ -70,174 +127,202 @@ def get_defaults(site_config: dict) -> dict:
     return site_config['defaults']
 
 
-def get_mountpoint(site_config: dict) -> str:
-    """ This function will provide the 'mountpoint'-key from 'defaults'."""
+def get_site_defaults(site_config: dict) -> Defaults:
+    """ This function will provide the validated 'defaults' of the site
+    configuration. The defaults are validated only once per configuration."""
+
+    cached = DEFAULTS_CACHE.get(id(site_config))
+    if cached is None or cached[0] is not site_config:
+        cached = (site_config, validate_defaults(site_config))
+        DEFAULTS_CACHE[id(site_config)] = cached
+    return cached[1]
+
+
+def validate_defaults(site_config: dict) -> Defaults:
+    """ This helper function validates the 'defaults' of the site
+    configuration."""
 
     defaults = get_defaults(site_config)
+
     assert 'mountpoint' in defaults, \
             "Value for 'mountpoint' was not found in site-config's 'defaults'."
-    
     mountpoint = defaults['mountpoint']
     assert isinstance(mountpoint, str), \
             "Value of 'mountpoint' was not a string."
     assert check_dir_exists(mountpoint), \
             "Path for mountpoint {0} does not exist.".format(mountpoint)
-    
-    return mountpoint
 
-def get_users_group(site_config: dict) -> str:
-    """ This function will provide the 'users_group'-key from 'defaults'."""
-
-    defaults = get_defaults(site_config)
     assert 'users_group' in defaults, \
             "Value for 'users_group' was not found in site-config's 'defaults'."
-    
     users_group = defaults['users_group']
     assert isinstance(users_group, str), \
             "Value of 'users_group' was not a string."
-    
-    return users_group
-    
-
-def get_work_dir_name(site_config: dict) -> str:
-    """ This function will provide the 'work_dir_name'-key from 'defaults'."""
 
-    defaults = get_defaults(site_config)
     assert 'work_dir_name' in defaults, \
             "Value for 'work_dir_name' was not found in site-config's 'defaults'."
-
     work_dir_name = defaults['work_dir_name']
     assert isinstance(work_dir_name, str), \
             "Value of 'work_dir_name' was not a string."
-    
-    return work_dir_name
-
-
-def get_dirstripe_count(site_config: dict) -> int:
-    """ This function will provide the 'dirstripe_count'-key
-    from 'defaults'."""
 
-    defaults = get_defaults(site_config)
     assert 'dirstripe_count' in defaults, \
             "Key 'dirstripe_count' is missing from 'defaults'."
-
     dirstripe_count = defaults['dirstripe_count']
     assert isinstance(dirstripe_count, int), \
             "Value of 'dirstripe_count' is not an integer."
 
-    return dirstripe_count
-
-
-def get_stripe_parameter_reference(site_config: dict) -> str:
-    """ This function will provide the loaded 'stripe_parameter_reference'. """
+    assert 'stripe_parameters' in defaults, \
+            "Key 'stripe_parameters' is missing from 'defaults'."
+    stripe_parameters = defaults['stripe_parameters']
+    assert isinstance(stripe_parameters, str), \
+            "Value of 'stripe_parameters' is not a string."
 
-    defaults = get_defaults(site_config)
-    
     assert 'stripe_parameter_reference' in defaults, \
             "Key 'stripe_parameter_reference' is missing from 'defaults'."
-
     stripe_parameter_reference = defaults['stripe_parameter_reference']
     assert isinstance(stripe_parameter_reference, str), \
             "Value of 'stripe_parameter_reference' is not a string."
-
-    assert os.path.isfile(stripe_parameter_reference), \
+    try:
+        reference_stat = os.stat(stripe_parameter_reference)
+    except OSError:
+        reference_stat = None
+    assert reference_stat is not None and stat.S_ISREG(reference_stat.st_mode), \
             "Stripe parameter reference '{0}' does not exist".format(
                 stripe_parameter_reference)
-    
-    with open(stripe_parameter_reference, 'r') as reference_file:
-        reference = reference_file.read()
+    reference = read_stripe_parameter_reference(
+        stripe_parameter_reference, reference_stat.st_mtime_ns)
 
-    return reference
+    assert 'default_quotas' in defaults, \
+            "Key 'default_quotas' is missing from 'defaults'."
+    default_quotas = defaults['default_quotas']
+    assert isinstance(default_quotas, dict), \
+            "Value of 'default_quotas' is not a dictionary."
 
+    assert 'projects' in default_quotas, \
+            "Key 'projects' is missing from 'default_quotas'."
+    default_project_quotas = default_quotas['projects']
+    assert isinstance(default_project_quotas, dict), \
+            "Value of 'projects' is not a dictionary."
+    assert check_quotadict(default_project_quotas), \
+        ("'projects' is not a proper quota "
+         "dictionary: {0}").format(default_project_quotas)
 
-def get_stripe_parameters(site_config: dict) -> str:
-    """ This function will provide the 'stripe_parameters'-key
-    from 'defaults'."""
+    assert 'workdir' in default_quotas, \
+            "Key 'workdir' is missing from 'default_quotas'."
+    default_workdir_quotas = default_quotas['workdir']
+    assert isinstance(default_workdir_quotas, dict), \
+            "Value of 'workdir' is not a dictionary."
+    assert check_quotadict(default_workdir_quotas), \
+        ("'workdir' is not a proper quota "
+         "dictionary: {0}").format(default_workdir_quotas)
 
-    defaults = get_defaults(site_config)
-    assert 'stripe_parameters' in defaults, \
-            "Key 'stripe_parameters' is missing from 'defaults'."
+    return Defaults(
+        mountpoint=mountpoint,
+        users_group=users_group,
+        work_dir_name=work_dir_name,
+        dirstripe_count=dirstripe_count,
+        stripe_parameters=stripe_parameters,
+        stripe_parameter_reference=reference,
+        default_quotas=default_quotas,
+        default_project_quotas=default_project_quotas,
+        default_workdir_quotas=default_workdir_quotas,
+    )
 
-    stripe_parameters = defaults['stripe_parameters']
-    assert isinstance(stripe_parameters, str), \
-            "Value of 'stripe_parameters' is not a string."
 
-    return stripe_parameters
+def get_mountpoint(site_config: dict) -> str:
+    """ This function will provide the 'mountpoint'-key from 'defaults'."""
 
+    return get_site_defaults(site_config).mountpoint
 
-def get_default_quotas(site_config: dict) -> dict:
-    """ This function will provide the default quotas from
-    'defaults'."""
 
-    defaults = get_defaults(site_config)
+def get_users_group(site_config: dict) -> str:
+    """ This function will provide the 'users_group'-key from 'defaults'."""
 
-    assert 'default_quotas' in defaults, \
-            "Key 'default_quotas' is missing from 'defaults'."
+    return get_site_defaults(site_config).users_group
 
-    default_quotas = defaults['default_quotas']
 
-    assert isinstance(default_quotas, dict), \
-            "Value of 'default_quotas' is not a dictionary."
+def get_work_dir_name(site_config: dict) -> str:
+    """ This function will provide the 'work_dir_name'-key from 'defaults'."""
 
-    return default_quotas
+    return get_site_defaults(site_config).work_dir_name
 
 
-def get_default_project_quotas(site_config: dict) -> dict:
-    """ This function will provide the default project quotas from
-    'default_quotas'."""
+def get_dirstripe_count(site_config: dict) -> int:
+    """ This function will provide the 'dirstripe_count'-key
+    from 'defaults'."""
 
-    default_quotas = get_default_quotas(site_config)
+    return get_site_defaults(site_config).dirstripe_count
 
-    assert 'projects' in default_quotas, \
-            "Key 'projects' is missing from 'default_quotas'."
 
-    default_project_quotas = default_quotas['projects']
+def get_stripe_parameter_reference(site_config: dict) -> str:
+    """ This function will provide the loaded 'stripe_parameter_reference'. """
 
-    assert isinstance(default_project_quotas, dict), \
-            "Value of 'projects' is not a dictionary."
+    return get_site_defaults(site_config).stripe_parameter_reference
 
-    assert check_quotadict(default_project_quotas), \
-        ("'projects' is not a proper quota "
-         "dictionary: {0}").format(default_project_quotas)
 
-    return default_project_quotas
+@lru_cache(maxsize=16)
+def read_stripe_parameter_reference(reference_path: str, mtime_ns: int) -> str:
+    """ This helper function reads the stripe parameter reference file.
+    The result is cached by path and modification time so that the
+    file is read only once per run."""
 
+    with open(reference_path, 'r') as reference_file:
+        reference = reference_file.read()
 
-def get_default_workdir_quotas(site_config: dict) -> dict:
-    """ This function will provide the default workdir quotas from
-    'default_quotas'."""
+    return reference
 
-    default_quotas = get_default_quotas(site_config)
 
-    assert 'workdir' in default_quotas, \
-            "Key 'workdir' is missing from 'default_quotas'."
+def get_stripe_parameters(site_config: dict) -> str:
+    """ This function will provide the 'stripe_parameters'-key
+    from 'defaults'."""
 
-    default_workdir_quotas = default_quotas['workdir']
+    return get_site_defaults(site_config).stripe_parameters
 
-    assert isinstance(default_workdir_quotas, dict), \
-            "Value of 'workdir' is not a dictionary."
 
-    assert check_quotadict(default_workdir_quotas), \
-        ("'workdir' is not a proper quota "
-         "dictionary: {0}").format(default_workdir_quotas)
+def get_default_quotas(site_config: dict) -> dict:
+    """ This function will provide the default quotas from
+    'defaults'."""
+
+    return get_site_defaults(site_config).default_quotas
+
+
+def get_default_project_quotas(site_config: dict) -> dict:
+    """ This function will provide the default project quotas from
+    'default_quotas'."""
+
+    return get_site_defaults(site_config).default_project_quotas
+
 
-    return default_workdir_quotas
+def get_default_workdir_quotas(site_config: dict) -> dict:
+    """ This function will provide the default workdir quotas from
+    'default_quotas'."""
+
+    return get_site_defaults(site_config).default_workdir_quotas
 
 
 
 def get_project_dirs(site_config: dict) -> Iterator[dict]:
     """ This function constructs an information dictionary for each project directory."""
 
-    mountpoint = get_mountpoint(site_config)
+    defaults = get_site_defaults(site_config)
+    mountpoint = defaults.mountpoint
+
+    stripe_parameters = defaults.stripe_parameters
+    stripe_parameter_reference = defaults.stripe_parameter_reference
 
-    stripe_parameters = get_stripe_parameters(site_config)
-    stripe_parameter_reference = get_stripe_parameter_reference(site_config)
+    default_project_quotas = defaults.default_project_quotas
 
-    default_project_quotas = get_default_project_quotas(site_config)
+    # Values shared by all project directories
+    project_dir_template = {
+        'mountpoint': mountpoint,
+        'stripe_parameters': stripe_parameters,
+        'stripe_parameter_reference': stripe_parameter_reference,
+        'permissions': '2770',
+    }
 
     for department_name, projects in site_config.get('project_dirs', {}).items():
         assert isinstance(projects, dict), \
                 "Department '{0}' is not a dictionary.".format(department_name)
+        department_dir = os.path.join(mountpoint, department_name)
         for project_name, project_quota_dict in projects.items():
 
             quotadict = initialize_quotadict(
@@ -250,12 +335,9 @@ def get_project_dirs(site_config: dict) -> Iterator[dict]:
                  "dictionary: {1}").format(project_name, quotadict)
 
             project_dir_info = {
-                'mountpoint': mountpoint,
+                **project_dir_template,
                 'name': project_name,
-                'path': os.path.join(mountpoint, department_name, project_name),
-                'stripe_parameters': stripe_parameters,
-                'stripe_parameter_reference': stripe_parameter_reference,
-                'permissions': '2770',
+                'path': os.path.join(department_dir, project_name),
                 'quota': quotadict,
             }
             yield project_dir_info
@@ -263,8 +345,6 @@ def get_project_dirs(site_config: dict) -> Iterator[dict]:
 def get_new_work_dir(site_config: dict, user: str) -> Iterator[dict]:
     """ This function constructs an information dictionary for each work directory."""
     
-    logger = get_logger()
-
     try:
         user_id = get_group_id(user)
     except ValueError as e:
@@ -274,16 +354,17 @@ def get_new_work_dir(site_config: dict, user: str) -> Iterator[dict]:
     assert isinstance(user_id, int), \
       'User id "%s" for user "%s" is invalid!' % (user_id, user)
 
-    mountpoint = get_mountpoint(site_config)
+    defaults = get_site_defaults(site_config)
+    mountpoint = defaults.mountpoint
 
     main_work_dir = get_main_work_dir(site_config)['path']
     
-    stripe_parameters = get_stripe_parameters(site_config)
-    stripe_parameter_reference = get_stripe_parameter_reference(site_config)
+    stripe_parameters = defaults.stripe_parameters
+    stripe_parameter_reference = defaults.stripe_parameter_reference
     
     workdir_quotas = site_config.get('work_dirs', {})
     
-    default_workdir_quota = get_default_workdir_quotas(site_config)
+    default_workdir_quota = defaults.default_workdir_quotas
     user_quota = workdir_quotas.get(user, {})
 
     quotadict = initialize_quotadict(
@@ -305,18 +386,30 @@ def get_new_work_dir(site_config: dict, user: str) -> Iterator[dict]:
 def get_work_dirs(site_config: dict) -> Iterator[dict]:
     """ This function constructs an information dictionary for each work directory."""
 
-    mountpoint = get_mountpoint(site_config)
+    defaults = get_site_defaults(site_config)
+    mountpoint = defaults.mountpoint
 
     main_work_dir = get_main_work_dir(site_config)['path']
 
-    stripe_parameters = get_stripe_parameters(site_config)
-    stripe_parameter_reference = get_stripe_parameter_reference(site_config)
+    stripe_parameters = defaults.stripe_parameters
+    stripe_parameter_reference = defaults.stripe_parameter_reference
 
-    default_workdir_quota = get_default_workdir_quotas(site_config)
+    default_workdir_quota = defaults.default_workdir_quotas
 
     workdir_quotas = site_config.get('work_dirs', {})
 
-    users_group = get_users_group(site_config)
+    users_group = defaults.users_group
+
+    # Project ids of work directories are looked up for every user
+    preload_group_ids()
+
+    # Values shared by all work directories
+    work_dir_template = {
+        'mountpoint': mountpoint,
+        'stripe_parameters': stripe_parameters,
+        'stripe_parameter_reference': stripe_parameter_reference,
+        'permissions': '2700',
+    }
 
     for user in get_group_users(users_group):
 
@@ -332,12 +425,9 @@ def get_work_dirs(site_config: dict) -> Iterator[dict]:
              "dictionary: {1}").format(user, quotadict)
 
         work_dir_info = {
-            'mountpoint': mountpoint,
+            **work_dir_template,
             'name': user,
             'path': os.path.join(main_work_dir, user),
-            'stripe_parameters': stripe_parameters,
-            'stripe_parameter_reference': stripe_parameter_reference,
-            'permissions': '2700',
             'quota': quotadict,
         }
         yield work_dir_info
@@ -346,12 +436,13 @@ def get_work_dirs(site_config: dict) -> Iterator[dict]:
 def get_main_work_dir(site_config: dict) -> dict:
     """ This function constructs an information dictionary for the main work directory."""
     
-    dirstripe_count = get_dirstripe_count(site_config)
-    stripe_parameters = get_stripe_parameters(site_config)
-    stripe_parameter_reference = get_stripe_parameter_reference(site_config)
+    defaults = get_site_defaults(site_config)
+    dirstripe_count = defaults.dirstripe_count
+    stripe_parameters = defaults.stripe_parameters
+    stripe_parameter_reference = defaults.stripe_parameter_reference
 
-    mountpoint = get_mountpoint(site_config)
-    work_dir_name = get_work_dir_name(site_config)
+    mountpoint = defaults.mountpoint
+    work_dir_name = defaults.work_dir_name
 
     work_dir_path = os.path.join(mountpoint, work_dir_name)
     main_work = {
@@ -368,11 +459,12 @@ def get_department_dirs(site_config: dict) -> Iterator[dict]:
     """ This function constructs an information dictionary for each
     department directory."""
 
-    dirstripe_count = get_dirstripe_count(site_config)
-    stripe_parameters = get_stripe_parameters(site_config)
-    stripe_parameter_reference = get_stripe_parameter_reference(site_config)
+    defaults = get_site_defaults(site_config)
+    dirstripe_count = defaults.dirstripe_count
+    stripe_parameters = defaults.stripe_parameters
+    stripe_parameter_reference = defaults.stripe_parameter_reference
 
-    mountpoint = get_mountpoint(site_config)
+    mountpoint = defaults.mountpoint
     for department_name, projects in site_config.get('project_dirs', {}).items():
         assert isinstance(projects, dict), \
                 "Department '{0}' is not a dictionary.".format(department_name)